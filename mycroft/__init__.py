@@ -12,15 +12,9 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 #
+from importlib import import_module
 from os.path import abspath, dirname, join
 from ovos_config.config import Configuration
-from mycroft.api import Api
-from mycroft.messagebus.message import Message
-
-from ovos_utils.intents import AdaptIntent, IntentBuilder, Intent
-from mycroft.skills.context import adds_context, removes_context
-from mycroft.skills import (MycroftSkill, FallbackSkill,
-                            intent_handler, intent_file_handler)
 from mycroft.util.log import LOG
 
 MYCROFT_ROOT_PATH = abspath(join(dirname(__file__), '..'))
@@ -29,6 +23,31 @@ __all__ = ['MYCROFT_ROOT_PATH',
            'Api',
            'Message']
 
+# re-exports are imported on first access (PEP 562), services importing a
+# submodule of mycroft don't pay for loading the skills framework
+_LAZY = {
+    'Api': 'mycroft.api',
+    'Message': 'mycroft.messagebus.message',
+    'AdaptIntent': 'ovos_utils.intents',
+    'IntentBuilder': 'ovos_utils.intents',
+    'Intent': 'ovos_utils.intents',
+    'adds_context': 'mycroft.skills.context',
+    'removes_context': 'mycroft.skills.context',
+    'MycroftSkill': 'mycroft.skills',
+    'FallbackSkill': 'mycroft.skills',
+    'intent_handler': 'mycroft.skills',
+    'intent_file_handler': 'mycroft.skills'
+}
+
+
+def __getattr__(name):
+    if name not in _LAZY:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(import_module(_LAZY[name]), name)
+    globals()[name] = value
+    return value
+
+
 _cfg = Configuration()
 _log_level = _cfg.get("log_level", "INFO")
 _logs_conf = _cfg.get("logs") or {}
@@ -31,8 +31,6 @@ def main(ready_hook=on_ready, error_hook=on_error, stopping_hook=on_stopping,
     setup_locale()
     service = PlaybackService(ready_hook=ready_hook, error_hook=error_hook,
                               stopping_hook=stopping_hook, watchdog=watchdog)
-    service.daemon = True
-    service.start()
     wait_for_exit_signal()
     service.shutdown()
 
@@ -1,16 +1,41 @@
+import hashlib
+import json
+import os
+import re
+import sys
 import time
-from threading import Thread, Lock
-from os.path import exists, expanduser
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from copy import deepcopy
+from functools import lru_cache
+from itertools import count
+from multiprocessing import get_context
+from queue import Queue
+from threading import Thread, Lock, Condition, Event, Semaphore, local
+from os.path import expanduser, splitext
+from stat import S_ISREG
 from mycroft_bus_client import Message
+from ovos_utils.messagebus import FakeBus
 
 from mycroft.audio.tts import TTSFactory, TTS
 from ovos_config.config import Configuration
 from mycroft.metrics import report_timing, Stopwatch
 from mycroft.audio.audioservice import AudioService
+from mycroft.audio.tts_cache import TTSAudioCache, hash_utterance
 from mycroft.util import check_for_signal, start_message_bus_client
 from mycroft.util.log import LOG
 from mycroft.util.process_utils import ProcessStatus, StatusCallbackMap
 
+try:
+    from pysbd import Segmenter
+except ImportError:
+    Segmenter = None
+
+_EMPTY = {}  # shared read-only fallback for messages without context
+# sentence boundaries, used when pysbd can't segment an utterance
+_SENTENCE_END = re.compile(r'(?<=[.!?])\s+')
+
 
 def on_ready():
     LOG.info('Audio service is ready.')
@@ -32,12 +57,133 @@ def on_stopping():
     LOG.info('Audio service is shutting down...')
 
 
-class PlaybackService(Thread):
+def _tts_config_hash(config, module):
+    """Digest of the configuration a TTS engine is loaded with.
+
+    Any change to the engine settings (voice, lang, ...) changes the hash,
+    not only switching to another module.
+
+    Args:
+        config (dict): "tts" section of mycroft.conf
+        module (str): TTS plugin the hash is computed for
+
+    Returns:
+        (bytes) 16 bytes digest
+    """
+    cfg = {"module": module, module: config.get(module) or {}}
+    data = json.dumps(cfg, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.blake2b(data.encode("utf-8"), digest_size=16).digest()
+
+
+@lru_cache()
+def _get_segmenter(lang):
+    try:
+        return Segmenter(language=lang, clean=False)
+    except ValueError:  # language not supported by pysbd
+        return None
+
+
+def split_sentences(utterance, lang="en-us"):
+    """Split an utterance into sentences that can be synthesized separately.
+
+    Uses pysbd, falling back to splitting on punctuation when it is not
+    installed or doesn't support the language.
+    Utterances containing markup (SSML) are not split, fragments would
+    end up with unbalanced tags.
+
+    Args:
+        utterance (str): text to split
+        lang (str): language of the utterance
+
+    Returns:
+        list of sentences
+    """
+    if "<" in utterance:
+        return [utterance]
+    segmenter = _get_segmenter(lang.split("-")[0]) if Segmenter else None
+    if segmenter:
+        sentences = segmenter.segment(utterance)
+    else:
+        sentences = _SENTENCE_END.split(utterance)
+    return [s.strip() for s in sentences if s.strip()] or [utterance]
+
+
+@lru_cache(maxsize=256)
+def _resolve_audio(audio_file):
+    """Resolve a queued sound file, only files that were found are cached.
+
+    Returns:
+        tuple (path, size in bytes, extension)
+
+    Raises:
+        FileNotFoundError if audio_file is not a file
+    """
+    path = expanduser(audio_file) if audio_file.startswith("~") else audio_file
+    st = os.stat(path)
+    if not S_ISREG(st.st_mode):
+        raise FileNotFoundError(path)
+    return path, st.st_size, splitext(path)[1][1:]
+
+
+class _TTSQueue:
+    """Proxy for TTS.queue that can divert the audio queued by a thread.
+
+    Used to capture the chunks a TTS engine synthesizes for an utterance
+    instead of sending them straight to the playback thread.
+    """
+
+    def __init__(self, queue):
+        self._queue = queue
+        self._local = local()
+
+    @contextmanager
+    def capture(self):
+        """Collect every item put in the queue by the current thread."""
+        previous = getattr(self._local, "buffer", None)
+        self._local.buffer = buffer = []
+        try:
+            yield buffer
+        finally:
+            self._local.buffer = previous
+
+    def put(self, item, *args, **kwargs):
+        buffer = getattr(self._local, "buffer", None)
+        if buffer is None:
+            return self._queue.put(item, *args, **kwargs)
+        buffer.append(item)
+
+    def __getattr__(self, item):
+        return getattr(self._queue, item)
+
+
+_worker_tts = None  # TTS engine of a synthesis worker process
+
+
+def _init_tts_worker(config):
+    """Load the TTS engine once per worker process."""
+    global _worker_tts
+    if not isinstance(TTS.queue, _TTSQueue):
+        TTS.queue = _TTSQueue(TTS.queue or Queue())
+    _worker_tts = TTSFactory.create(config)
+    # audio is played by the parent process, the worker has no bus
+    _worker_tts.bus = FakeBus()
+
+
+def _tts_worker_execute(utterance, ident, listen):
+    """Synthesize in a worker process.
+
+    Returns:
+        list of TTS.queue items, referencing the synthesized audio files
+    """
+    with TTS.queue.capture() as queued:
+        _worker_tts.execute(utterance, ident, listen)
+    return queued
+
+
+class PlaybackService:
     def __init__(self, ready_hook=on_ready, error_hook=on_error,
                  stopping_hook=on_stopping, alive_hook=on_alive,
                  started_hook=on_started, watchdog=lambda: None, bus=None):
-        super(PlaybackService, self).__init__()
-
         LOG.info("Starting Audio Service")
         callbacks = StatusCallbackMap(on_ready=ready_hook, on_error=error_hook,
                                       on_stopping=stopping_hook,
@@ -49,12 +195,63 @@ class PlaybackService(Thread):
         self.config = Configuration()
         self.native_sources = self.config["Audio"].get("native_sources",
                                                        ["debug_cli", "audio"]) or []
+        self._native_set = frozenset(self.native_sources)
+        # timings are only uploaded when opted in, skip measuring otherwise
+        self._metrics_enabled = bool(self.config.get("opt_in", False))
         self.tts = None
+        self._tts_cfg = None
         self._tts_hash = None
         self.lock = Lock()
         self.fallback_tts = None
         self._fallback_tts_hash = None
         self._last_stop_signal = 0
+        self._is_speaking = Event()
+        # also honour the isSpeaking signal file written by the playback
+        # thread, for setups relying on the legacy IPC
+        self._speaking_signal = self.config["Audio"].get(
+            "speaking_signal_file", False)
+
+        # utterances are synthesized concurrently but handed to playback
+        # in the order they were received. The semaphore bounds synthesis,
+        # the extra threads hold finished tasks waiting for their turn so
+        # they don't take synthesis slots from the following ones
+        tts_concurrency = self.config["Audio"].get("tts_concurrency", 3)
+        self._tts_sem = Semaphore(tts_concurrency)
+        self._tts_executor = ThreadPoolExecutor(
+            max_workers=tts_concurrency * 2, thread_name_prefix="tts")
+        self._next_task_id = count()
+        self._last_task_id = -1
+        self._playback_cursor = 0
+        self._playback_cond = Condition()
+        # synthesize in worker processes, spawned on first use
+        self._tts_workers = self.config["Audio"].get("tts_workers", 0)
+        self._tts_pool = None
+
+        # TTS.queue is only created by the first TTS engine, create it here
+        # so the engines and the playback thread share the proxy
+        if not isinstance(TTS.queue, _TTSQueue):
+            TTS.queue = _TTSQueue(TTS.queue or Queue())
+        cache_cfg = self.config["Audio"].get("tts_cache") or {}
+        if cache_cfg.get("enabled", True):
+            self._tts_cache = TTSAudioCache(
+                max_entries=cache_cfg.get("max_entries", 256),
+                max_disk_entries=cache_cfg.get("max_disk_entries", 4096),
+                ttl=cache_cfg.get("ttl", 604800))
+        else:
+            self._tts_cache = None
+
+        # bound once, event names interned for the emitter dict lookups
+        handlers = (
+            ('mycroft.stop', self.handle_stop),
+            ('mycroft.audio.speech.stop', self.handle_stop),
+            ('mycroft.audio.queue', self.handle_queue_audio),
+            ('speak', self.handle_speak),
+            ('recognizer_loop:audio_output_start',
+             self.handle_audio_output_start),
+            ('recognizer_loop:audio_output_end', self.handle_audio_output_end),
+            ('ovos.languages.tts', self.handle_get_languages_tts))
+        self._handlers = tuple((sys.intern(event), handler)
+                               for event, handler in handlers)
 
         whitelist = ['mycroft.audio.service']
         self.bus = bus or start_message_bus_client("AUDIO",
@@ -75,7 +272,17 @@ class PlaybackService(Thread):
             LOG.exception(e)
             self.status.set_error(e)
 
-    def run(self):
+        # bus handlers run on the messagebus client threads, only waiting
+        # for the audio backends needs a thread of its own
+        Thread(target=self._await_ready, daemon=True,
+               name="audio-ready").start()
+
+    def start(self):
+        """Deprecated, the service is running once it is created."""
+        LOG.warning("PlaybackService is no longer a Thread, "
+                    "start() does nothing and will be removed")
+
+    def _await_ready(self):
         if self.audio.wait_for_load():
             if len(self.audio.service) == 0:
                 LOG.warning('No audio backends loaded! '
@@ -87,64 +294,133 @@ class PlaybackService(Thread):
         else:
             self.status.set_error('No TTS loaded')
 
+    @staticmethod
+    def _ctx(message, key, default=None):
+        """Read a message.context value, context may be None."""
+        return (message.context or _EMPTY).get(key, default)
+
     def handle_speak(self, message):
         """Handle "speak" message
 
-        Parse sentences and invoke text to speech service.
+        Split the utterance in sentences and synthesize them concurrently,
+        playback starts as soon as the first sentence is ready.
         """
 
         # if the message is targeted and audio is not the target don't
         # don't synthesise speech
-        message.context = message.context or {}
-        if message.context.get('destination') and not \
-                any(s in message.context['destination'] for s in self.native_sources):
-            return
+        dest = self._ctx(message, 'destination')
+        if dest:
+            if isinstance(dest, str):
+                dest = [dest]
+            if self._native_set.isdisjoint(dest):
+                return
 
         # Get conversation ID
-        if message.context and 'ident' in message.context:
-            ident = message.context['ident']
-        else:
-            ident = 'unknown'
-
+        ident = self._ctx(message, 'ident', 'unknown')
+
+        utterance = message.data['utterance']
+        listen = message.data.get('expect_response', False)
+        lang = message.data.get('lang') or self.config.get('lang') or 'en-us'
+        sentences = split_sentences(utterance, lang)
+        created = time.time()
+        # task ids must follow submission order, see _synth
         with self.lock:
-            stopwatch = Stopwatch()
-            stopwatch.start()
+            for idx, sentence in enumerate(sentences):
+                last = idx == len(sentences) - 1
+                tid = self._last_task_id = next(self._next_task_id)
+                self._tts_executor.submit(self._synth, tid, sentence, ident,
+                                          listen and last, created)
 
-            utterance = message.data['utterance']
-            listen = message.data.get('expect_response', False)
-            self.execute_tts(utterance, ident, listen)
+    def _synth(self, tid, utterance, ident, listen, created):
+        """Synthesize an utterance and queue it for playback in turn.
 
-            stopwatch.stop()
+        Synthesis runs concurrently for up to tts_concurrency utterances,
+        the audio of each one is held back until all utterances received
+        before it have been queued.
 
-        report_timing(ident, 'speech', stopwatch,
-                      {'utterance': utterance,
-                       'tts': self.tts.__class__.__name__})
+        Args:
+            tid (int): task id, order in which the utterance was received
+            utterance (str): sentence to speak
+            ident (str): interaction id for metrics
+            listen (bool): True if interaction should end with mycroft listening
+            created (float): time the speak request was received
+        """
+        queued = []
+        try:
+            with self._tts_sem, TTS.queue.capture() as queued:
+                if not self._metrics_enabled:
+                    self.execute_tts(utterance, ident, listen)
+                else:
+                    stopwatch = Stopwatch()
+                    with stopwatch:
+                        self.execute_tts(utterance, ident, listen)
+                    report_timing(ident, 'speech', stopwatch,
+                                  {'utterance': utterance,
+                                   'tts': self.tts.__class__.__name__})
+        except Exception as e:
+            LOG.exception(f"TTS task failed! {e}")
+        finally:
+            with self._playback_cond:
+                self._playback_cond.wait_for(
+                    lambda: self._playback_cursor == tid)
+                try:
+                    # drop speech that was stopped while being synthesized
+                    if self._last_stop_signal < created:
+                        for q in queued:
+                            TTS.queue.put(q)
+                except Exception as e:
+                    LOG.exception(f"Failed to queue TTS audio! {e}")
+                finally:
+                    # never leave the following tasks waiting for their turn
+                    self._playback_cursor += 1
+                    self._playback_cond.notify_all()
 
     def _maybe_reload_tts(self):
-        config = self.config.get("tts", {})
+        config = deepcopy(self.config.get("tts") or {})
+        # skip reloads triggered by changes outside the tts section
+        if self.tts and config == self._tts_cfg:
+            return
+        self._tts_cfg = config
+        try:
+            self._reload_tts(config)
+        except Exception:
+            # forget the snapshot so the next call retries the reload
+            self._tts_cfg = None
+            raise
 
+    def _reload_tts(self, config):
         # update TTS object if configuration has changed
-        if not self._tts_hash or self._tts_hash != config.get("module", ""):
+        module = config.get("module", "")
+        tts_hash = _tts_config_hash(config, module)
+        if not self._tts_hash or self._tts_hash != tts_hash:
             if self.tts:
                 self.tts.shutdown()
+                if self._tts_cache:
+                    self._tts_cache.clear()
+                if self._tts_pool:
+                    self._tts_pool.shutdown(wait=False)
+                    self._tts_pool = None
             # Create new tts instance
             LOG.info("(re)loading TTS engine")
             self.tts = TTSFactory.create(config)
             self.tts.init(self.bus)
-            self._tts_hash = config.get("module", "")
+            self._tts_hash = tts_hash
 
         # if fallback TTS is the same as main TTS dont load it
-        if config.get("module", "") == config.get("fallback_module", ""):
+        fallback_module = config.get("fallback_module", "")
+        if module == fallback_module:
             return
 
+        fallback_hash = _tts_config_hash(config, fallback_module)
         if not self._fallback_tts_hash or \
-                self._fallback_tts_hash != config.get("fallback_module", ""):
+                self._fallback_tts_hash != fallback_hash:
             if self.fallback_tts:
                 self.fallback_tts.shutdown()
+                self.fallback_tts = None
             # Create new tts instance
             LOG.info("(re)loading fallback TTS engine")
             self._get_tts_fallback()
-            self._fallback_tts_hash = config.get("fallback_module", "")
+            self._fallback_tts_hash = fallback_hash
 
     def execute_tts(self, utterance, ident, listen=False):
         """Mute mic and start speaking the utterance using selected tts backend.
@@ -155,20 +431,76 @@ class PlaybackService(Thread):
             listen:     True if a user response is expected
         """
         LOG.info("Speak: " + utterance)
+        key = None
+        if self._tts_cache:
+            key = hash_utterance(self._tts_hash.hex(), self.tts.voice,
+                                 self.tts.lang, utterance)
+            chunks = self._tts_cache.get(key)
+            if chunks:
+                LOG.debug(f"TTS cache hit: {key}")
+                for idx, chunk in enumerate(chunks):
+                    last = idx == len(chunks) - 1
+                    # (audio_ext, audio_file, visemes, ident, listen, tts_id)
+                    TTS.queue.put(chunk[:3] + (ident, listen and last) +
+                                  chunk[3:])
+                return
         try:
-            self.tts.execute(utterance, ident, listen)
+            if key:
+                with TTS.queue.capture() as queued:
+                    self._execute_engine(utterance, ident, listen)
+            else:
+                self._execute_engine(utterance, ident, listen)
         except Exception as e:
             LOG.exception(f"TTS synth failed! {e}")
             if self._tts_hash != self._fallback_tts_hash:
                 self.execute_fallback_tts(utterance, ident, listen)
+            return
+
+        if key:
+            try:
+                # ident and listen belong to this request, not to the audio
+                self._tts_cache.put(key, [q[:3] + q[5:] for q in queued])
+            except Exception as e:
+                LOG.warning(f"Failed to cache TTS audio: {e}")
+            for q in queued:
+                TTS.queue.put(q)
+
+    def _execute_engine(self, utterance, ident, listen):
+        """Run the TTS engine, in a worker process if tts_workers is set.
+
+        CPU bound engines holding the GIL would otherwise serialize the
+        concurrent synthesis of sentences.
+        """
+        if not self._tts_workers:
+            self.tts.execute(utterance, ident, listen)
+            return
+        with self.lock:
+            if not self._tts_pool:
+                self._tts_pool = ProcessPoolExecutor(
+                    max_workers=self._tts_workers,
+                    mp_context=get_context("spawn"),
+                    initializer=_init_tts_worker,
+                    initargs=(self._tts_cfg,))
+            pool = self._tts_pool
+        try:
+            queued = pool.submit(_tts_worker_execute, utterance, ident,
+                                 listen).result()
+        except BrokenProcessPool:
+            # a worker died, respawn the pool on next use
+            with self.lock:
+                if self._tts_pool is pool:
+                    self._tts_pool = None
+            raise
+        for item in queued:
+            TTS.queue.put(item)
 
     def _get_tts_fallback(self):
         """Lazily initializes the fallback TTS if needed."""
         if not self.fallback_tts:
-            config = Configuration()
-            engine = config.get('tts', {}).get("fallback_module", "mimic")
+            config = self._tts_cfg or {}
+            engine = config.get("fallback_module", "mimic")
             cfg = {"tts": {"module": engine,
-                           engine: config.get('tts', {}).get(engine, {})}}
+                           engine: config.get(engine, {})}}
             self.fallback_tts = TTSFactory.create(cfg)
             self.fallback_tts.validator.validate()
             self.fallback_tts.init(self.bus)
@@ -197,26 +529,37 @@ class PlaybackService(Thread):
 
         Shutdown any speech.
         """
-        if check_for_signal("isSpeaking", -1):
+        speaking = self._is_speaking.is_set() or \
+            self._playback_cursor <= self._last_task_id or \
+            (self._speaking_signal and check_for_signal("isSpeaking", -1))
+        if speaking:
             self._last_stop_signal = time.time()
             self.tts.playback.clear()  # Clear here to get instant stop
             self.bus.emit(Message("mycroft.stop.handled", {"by": "TTS"}))
 
+    def handle_audio_output_start(self, message):
+        self._is_speaking.set()
+
+    def handle_audio_output_end(self, message):
+        self._is_speaking.clear()
+
     def handle_queue_audio(self, message):
         """ Queue a sound file to play in speech thread
          ensures it doesnt play over TTS """
-        viseme = message.data.get("viseme")
-        ident = message.data.get("ident") or message.context.get("ident")  # unused ?
-        audio_ext = message.data.get("audio_ext")  # unused ?
-        audio_file = message.data.get("filename")
+        data = message.data
+        audio_file = data.get("filename")
         if not audio_file:
-            raise ValueError(f"'filename' missing from message.data: {message.data}")
-        audio_file = expanduser(audio_file)
-        if not exists(audio_file):
+            raise ValueError(f"'filename' missing from message.data: {data}")
+        try:
+            audio_file, _, ext = _resolve_audio(audio_file)
+        except FileNotFoundError:
             raise FileNotFoundError(f"{audio_file} does not exist")
-        audio_ext = audio_ext or audio_file.split(".")[-1]
-        listen = message.data.get("listen", False)
-        TTS.queue.put((audio_ext, str(audio_file), viseme, ident, listen))
+        # audio_ext overrides the file extension, ident is passed along to
+        # the playback thread with the audio
+        audio_ext = data.get("audio_ext") or ext
+        ident = data.get("ident") or self._ctx(message, "ident")
+        TTS.queue.put((audio_ext, audio_file, data.get("viseme"), ident,
+                       data.get("listen", False)))
 
     def handle_get_languages_tts(self, message):
         """
@@ -234,6 +577,9 @@ class PlaybackService(Thread):
         Stop any playing audio and make sure threads are joined correctly.
         """
         self.status.set_stopping()
+        self._tts_executor.shutdown(wait=False)
+        if self._tts_pool:
+            self._tts_pool.shutdown(wait=False)
         if self.tts.playback:
             self.tts.playback.shutdown()
             self.tts.playback.join()
@@ -244,8 +590,5 @@ class PlaybackService(Thread):
         Start speech related handlers.
         """
         Configuration.set_config_update_handlers(self.bus)
-        self.bus.on('mycroft.stop', self.handle_stop)
-        self.bus.on('mycroft.audio.speech.stop', self.handle_stop)
-        self.bus.on('mycroft.audio.queue', self.handle_queue_audio)
-        self.bus.on('speak', self.handle_speak)
-        self.bus.on('ovos.languages.tts', self.handle_get_languages_tts)
+        for event, handler in self._handlers:
+            self.bus.on(event, handler)
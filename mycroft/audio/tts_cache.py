@@ -0,0 +1,154 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+from collections import OrderedDict
+from os.path import join, isfile
+from threading import Lock
+
+from mycroft.util.file_utils import get_cache_directory
+from mycroft.util.log import LOG
+
+
+def hash_utterance(tts_hash, voice, lang, utterance):
+    """Content address of a synthesized utterance.
+
+    Args:
+        tts_hash: identifier of the loaded TTS engine configuration
+        voice (str): voice used for synthesis
+        lang (str): language used for synthesis
+        utterance (str): the sentence being spoken
+
+    Returns:
+        (str) hex digest identifying the synthesized audio
+    """
+    key = f"{tts_hash}|{voice}|{lang}|{utterance}"
+    return hashlib.blake2b(key.encode("utf-8"), digest_size=16).hexdigest()
+
+
+class TTSAudioCache:
+    """Index of synthesized speech, keyed by utterance hash.
+
+    The audio files belong to the TTS engine (OPM keeps them in its own
+    per sentence cache), this only remembers which files an utterance
+    produced so a repeated utterance skips the engine altogether instead
+    of being preprocessed and looked up again. Nothing is copied, entries
+    whose files are gone are dropped on lookup.
+
+    Every entry is stored as ``<key>.json`` following a
+    ``{chunks, ttl, createAt}`` schema, recently used entries are kept in
+    a bounded LRU so hits don't touch the disk.
+
+    Args:
+        cache_dir (str): directory holding the index
+        max_entries (int): number of entries kept in memory
+        max_disk_entries (int): number of entries kept on disk, oldest
+                                entries are evicted first
+        ttl (int): seconds an entry remains valid, 0 or less never expires
+    """
+
+    def __init__(self, cache_dir=None, max_entries=256,
+                 max_disk_entries=4096, ttl=604800):
+        self.cache_dir = cache_dir or get_cache_directory("tts_audio")
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.max_entries = max_entries
+        self.max_disk_entries = max_disk_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = Lock()
+        # keys stored on disk, oldest first, so eviction doesn't scan the dir
+        self._disk_keys = OrderedDict((key, True) for key in self._scan())
+
+    def _scan(self):
+        names = [name for name in os.listdir(self.cache_dir)
+                 if name.endswith(".json")]
+        names.sort(key=lambda n: os.stat(join(self.cache_dir, n)).st_mtime)
+        return [name[:-len(".json")] for name in names]
+
+    def _meta_path(self, key):
+        return join(self.cache_dir, f"{key}.json")
+
+    def _expired(self, entry):
+        ttl = entry.get("ttl", 0)
+        return ttl > 0 and time.time() - entry.get("createAt", 0) > ttl
+
+    def _load(self, key):
+        path = self._meta_path(key)
+        if not isfile(path):
+            return None
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except Exception as e:
+            LOG.warning(f"Failed to read cached TTS entry {path}: {e}")
+            return None
+
+    def _remember(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _remove(self, key):
+        self._entries.pop(key, None)
+        self._disk_keys.pop(key, None)
+        if isfile(self._meta_path(key)):
+            os.remove(self._meta_path(key))
+
+    def get(self, key):
+        """Get the audio previously synthesized for an utterance.
+
+        Args:
+            key (str): utterance hash, see hash_utterance
+
+        Returns:
+            list of (audio_ext, audio_file, visemes, ...) or None if not cached
+        """
+        with self._lock:
+            entry = self._entries.get(key) or self._load(key)
+            if not entry:
+                return None
+            if self._expired(entry) or \
+                    not all(isfile(c[1]) for c in entry["chunks"]):
+                self._remove(key)
+                return None
+            self._remember(key, entry)
+            return [tuple(c) for c in entry["chunks"]]
+
+    def put(self, key, chunks):
+        """Remember the audio synthesized for an utterance.
+
+        Args:
+            key (str): utterance hash, see hash_utterance
+            chunks (list): (audio_ext, audio_file, visemes, ...) produced
+                           by the TTS engine, extra fields are kept as is
+        """
+        if not chunks or not all(isinstance(c[1], str) and isfile(c[1])
+                                 for c in chunks):
+            return
+        with self._lock:
+            entry = {"chunks": [list(c) for c in chunks], "ttl": self.ttl,
+                     "createAt": time.time()}
+            meta = self._meta_path(key)
+            with open(meta + ".tmp", "w") as f:
+                json.dump(entry, f)
+            os.replace(meta + ".tmp", meta)
+            self._remember(key, entry)
+            self._disk_keys[key] = True
+            self._disk_keys.move_to_end(key)
+            self._evict()
+
+    def _evict(self):
+        """Drop the oldest entries above max_disk_entries."""
+        while len(self._disk_keys) > self.max_disk_entries:
+            key = next(iter(self._disk_keys))
+            self._remove(key)
+
+    def clear(self):
+        """Forget every cached utterance."""
+        with self._lock:
+            self._entries.clear()
+            self._disk_keys.clear()
+            shutil.rmtree(self.cache_dir, ignore_errors=True)
+            os.makedirs(self.cache_dir, exist_ok=True)
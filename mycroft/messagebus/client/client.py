@@ -13,7 +13,13 @@
 # limitations under the License.
 #
 
+import hashlib
+from collections import OrderedDict
+from threading import Lock
+from weakref import WeakSet
+
 from mycroft_bus_client import MessageBusClient as _MessageBusClient
+from mycroft_bus_client import Message
 from mycroft_bus_client.client import MessageWaiter
 
 from mycroft.messagebus.load_config import load_message_bus_config
@@ -35,6 +41,89 @@ class MessageBusClient(_MessageBusClient):
         super().__init__(config.host, config.port, config.route, config.ssl)
 
 
+class _SerializedMessage(Message):
+    """Message sent as an already serialized string."""
+    def __init__(self, message, serialized):
+        super().__init__(message.msg_type, message.data, message.context)
+        self._serialized = serialized
+
+    def serialize(self):
+        return self._serialized
+
+
+class InProcessMessageBusClient(MessageBusClient):
+    """MessageBusClient short-circuiting messages between clients of the
+    same process.
+
+    Emitted messages are handed directly to every InProcessMessageBusClient
+    living in this process instead of waiting for the messagebus to send
+    them back. They are still sent to the messagebus for remote clients,
+    the copy the server echoes back is dropped without being parsed.
+    The messagebus relays messages untouched, echoes are recognized by the
+    digest of the string that was sent.
+    """
+    # every in-process client, messages are delivered to all of them
+    _local_bus = WeakSet()
+    # bounds the pending echoes, in case the server never sends them back
+    _max_pending = 1000
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._pending = OrderedDict()
+        self._pending_lock = Lock()
+        InProcessMessageBusClient._local_bus.add(self)
+
+    @staticmethod
+    def _digest(serialized):
+        return hashlib.blake2b(serialized.encode("utf-8"),
+                               digest_size=16).digest()
+
+    def _expect_echo(self, digest):
+        with self._pending_lock:
+            # identical messages may be emitted before their echoes arrive
+            self._pending[digest] = self._pending.get(digest, 0) + 1
+            while len(self._pending) > self._max_pending:
+                self._pending.popitem(last=False)
+
+    def _is_echo(self, serialized):
+        with self._pending_lock:
+            if not self._pending:
+                return False
+            digest = self._digest(serialized)
+            pending = self._pending.get(digest)
+            if not pending:
+                return False
+            if pending == 1:
+                del self._pending[digest]
+            else:
+                self._pending[digest] = pending - 1
+            return True
+
+    def _deliver(self, serialized):
+        # every client gets its own copy, as if it came from the websocket
+        message = Message.deserialize(serialized)
+        self.emitter.emit('message', serialized)
+        self.emitter.emit(message.msg_type, message)
+
+    def emit(self, message):
+        message.context = message.context or {}
+        serialized = message.serialize()
+        digest = self._digest(serialized)
+        clients = list(self._local_bus)
+        # register before sending, the echo may arrive at any time
+        for client in clients:
+            client._expect_echo(digest)
+        super().emit(_SerializedMessage(message, serialized))
+        for client in clients:
+            client._deliver(serialized)
+
+    def on_message(self, *args):
+        message = args[0] if len(args) == 1 else args[1]
+        if self._is_echo(message):
+            return  # already delivered in-process
+        self._deliver(message)
+
+
 def echo():
     message_bus_client = MessageBusClient()
 
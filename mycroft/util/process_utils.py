@@ -109,7 +109,8 @@ def create_echo_function(name, whitelist=None):
     return echo
 
 
-def start_message_bus_client(service, bus=None, whitelist=None):
+def start_message_bus_client(service, bus=None, whitelist=None,
+                             inprocess=None):
     """Start the bus client daemon and wait for connection.
 
     Args:
@@ -117,12 +118,21 @@ def start_message_bus_client(service, bus=None, whitelist=None):
         bus (MessageBusClient): an instance of the Mycroft MessageBusClient
         whitelist (list, optional): List of "type" strings. If defined, only
                                     messages in this list will be logged.
+        inprocess (bool, optional): deliver messages directly to the other
+                                    services running in this process, defaults
+                                    to the websocket "inprocess" config
     Returns:
         A connected instance of the MessageBusClient
     """
     # Create a client if one was not provided
     if bus is None:
-        bus = mycroft.messagebus.client.MessageBusClient()
+        if inprocess is None:
+            inprocess = Configuration().get("websocket", {}).get("inprocess",
+                                                                 False)
+        if inprocess:
+            bus = mycroft.messagebus.client.InProcessMessageBusClient()
+        else:
+            bus = mycroft.messagebus.client.MessageBusClient()
     Configuration.set_config_update_handlers(bus)
     bus_connected = Event()
     bus.on('message', create_echo_function(service, whitelist))
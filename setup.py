@@ -10,56 +10,48 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 #
+import functools
 import os
-import os.path
+import re
+from pathlib import Path
 
-from setuptools import setup, find_packages
+from setuptools import setup
 
 BASEDIR = os.path.abspath(os.path.dirname(__file__))
+VERSION_RE = re.compile(r'^OVOS_VERSION_(MAJOR|MINOR|BUILD|ALPHA)\s*=\s*(\S+)',
+                        re.MULTILINE)
+PINNED_RE = re.compile(r'==|~=')
 
 
 def get_version():
     """ Find the version of ovos-core"""
-    version = None
     version_file = os.path.join(BASEDIR, 'mycroft', 'version.py')
-    major, minor, build, alpha = (None, None, None, None)
     with open(version_file) as f:
-        for line in f:
-            if 'OVOS_VERSION_MAJOR' in line:
-                major = line.split('=')[1].strip()
-            elif 'OVOS_VERSION_MINOR' in line:
-                minor = line.split('=')[1].strip()
-            elif 'OVOS_VERSION_BUILD' in line:
-                build = line.split('=')[1].strip()
-            elif 'OVOS_VERSION_ALPHA' in line:
-                alpha = line.split('=')[1].strip()
-
-            if ((major and minor and build and alpha) or
-                    '# END_VERSION_BLOCK' in line):
-                break
+        text = f.read().split('# END_VERSION_BLOCK')[0]
+    parts = dict(VERSION_RE.findall(text))
+    major, minor, build, alpha = (parts.get('MAJOR'), parts.get('MINOR'),
+                                  parts.get('BUILD'), parts.get('ALPHA'))
     version = f"{major}.{minor}.{build}"
     if int(alpha):
         version += f"a{alpha}"
     return version
 
 
+@functools.lru_cache(maxsize=None)
 def required(requirements_file):
     """ Read requirements file and remove comments and empty lines. """
-    with open(os.path.join(BASEDIR, requirements_file), 'r') as f:
-        requirements = f.read().splitlines()
-        if 'MYCROFT_LOOSE_REQUIREMENTS' in os.environ:
-            print('USING LOOSE REQUIREMENTS!')
-            requirements = [r.replace('==', '>=').replace('~=', '>=') for r in requirements]
-        return [pkg for pkg in requirements
-                if pkg.strip() and not pkg.startswith("#")]
+    requirements = Path(BASEDIR, requirements_file).read_text().splitlines()
+    if 'MYCROFT_LOOSE_REQUIREMENTS' in os.environ:
+        print('USING LOOSE REQUIREMENTS!')
+        requirements = [PINNED_RE.sub('>=', r) for r in requirements]
+    return [pkg for pkg in requirements
+            if pkg.strip() and not pkg.startswith("#")]
 
 
+# package metadata and entry points live in pyproject.toml, requirements are
+# read here so MYCROFT_LOOSE_REQUIREMENTS keeps working
 setup(
-    name='ovos-core',
     version=get_version(),
-    license='Apache-2.0',
-    url='https://github.com/OpenVoiceOS/ovos-core',
-    description='mycroft-core packaged as a library',
     install_requires=required('requirements/minimal.txt'),
     extras_require={
         'audio': required('requirements/extra-audiobackend.txt'),
@@ -73,20 +65,5 @@ setup(
         'bus': required('requirements/extra-bus.txt'),
         'deprecated': required('requirements/extra-deprecated.txt'),
         'all': required('requirements/requirements.txt')
-    },
-    packages=find_packages(include=['mycroft*']),
-    include_package_data=True,
-    entry_points={
-        'console_scripts': [
-            'mycroft-speech-client=mycroft.listener.__main__:main',
-            'mycroft-messagebus=mycroft.messagebus.service.__main__:main',
-            'mycroft-skills=mycroft.skills.__main__:main',
-            'mycroft-audio=mycroft.audio.__main__:main',
-            'mycroft-echo-observer=mycroft.messagebus.client.ws:echo',
-            'mycroft-audio-test=mycroft.util.audio_test:main',
-            'mycroft-enclosure-client=ovos_PHAL.__main__:main',
-            'mycroft-cli-client=mycroft.client.text.__main__:main',
-            'mycroft-gui-service=mycroft.gui.__main__:main'
-        ]
     }
 )
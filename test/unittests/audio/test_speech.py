@@ -15,13 +15,19 @@
 import unittest
 import unittest.mock as mock
 
+from concurrent.futures.process import BrokenProcessPool
+from queue import Queue
 from shutil import rmtree
+from tempfile import mkdtemp
 from threading import Thread
 from time import sleep
 
-from os.path import exists
+from os.path import exists, dirname
 
-from mycroft.audio.service import PlaybackService
+from mycroft.audio.service import PlaybackService, _TTSQueue, \
+    split_sentences, _init_tts_worker, _tts_worker_execute
+from mycroft.audio.tts import TTS
+from mycroft.audio.tts_cache import TTSAudioCache
 from mycroft.messagebus import Message
 from mycroft.tts.remote_tts import RemoteTTSTimeoutException
 
@@ -34,6 +40,7 @@ tts_mock = mock.Mock()
 def setup_mocks(config_mock, tts_factory_mock):
     """Do the common setup for the mocks."""
     config_mock.get.return_value = {}
+    config_mock.return_value = {"Audio": {"tts_cache": {"enabled": False}}}
 
     tts_factory_mock.create.return_value = tts_mock
     config_mock.reset_mock()
@@ -49,8 +56,7 @@ class TestSpeech(unittest.TestCase):
         setup_mocks(config_mock, tts_factory_mock)
         bus = mock.Mock()
         speech = PlaybackService(bus=bus)
-        speech.daemon = True
-        speech.run()
+        speech._await_ready()
 
         self.assertTrue(tts_factory_mock.create.called)
         bus.on.assert_any_call('mycroft.stop', speech.handle_stop)
@@ -59,13 +65,11 @@ class TestSpeech(unittest.TestCase):
         bus.on.assert_any_call('speak', speech.handle_speak)
 
         speech.shutdown()
-        self.assertFalse(speech.is_alive())
         # TODO TTS.playback is now a singleton, this test does not reach it anymore when using mock
         #self.assertTrue(tts_mock.playback.stop.called)
         #self.assertTrue(tts_mock.playback.join.called)
 
-    @mock.patch('mycroft.audio.service.check_for_signal')
-    def test_stop(self, check_for_signal_mock, tts_factory_mock, config_mock):
+    def test_stop(self, tts_factory_mock, config_mock):
         """Ensure the stop handler signals stop correctly."""
         setup_mocks(config_mock, tts_factory_mock)
         bus = mock.Mock()
@@ -73,13 +77,248 @@ class TestSpeech(unittest.TestCase):
         speech = PlaybackService(bus=bus)
 
         speech._last_stop_signal = 0
-        check_for_signal_mock.return_value = False
         speech.handle_stop(Message('mycroft.stop'))
         self.assertEqual(speech._last_stop_signal, 0)
 
-        check_for_signal_mock.return_value = True
+        speech.handle_audio_output_start(
+            Message('recognizer_loop:audio_output_start'))
         speech.handle_stop(Message('mycroft.stop'))
         self.assertNotEqual(speech._last_stop_signal, 0)
+
+        speech._last_stop_signal = 0
+        speech.handle_audio_output_end(
+            Message('recognizer_loop:audio_output_end'))
+        speech.handle_stop(Message('mycroft.stop'))
+        self.assertEqual(speech._last_stop_signal, 0)
+        speech.shutdown()
+
+    @mock.patch('mycroft.audio.service.TTS')
+    def test_speak_order(self, tts_cls_mock, tts_factory_mock, config_mock):
+        """Ensure concurrently synthesized speech is played in order."""
+        setup_mocks(config_mock, tts_factory_mock)
+        tts_cls_mock.queue = _TTSQueue(Queue())
+
+        def execute(utterance, ident, listen):
+            # later utterances finish synthesis first
+            sleep(0.1 * (3 - int(utterance)))
+            tts_cls_mock.queue.put(("wav", utterance, None, ident, listen))
+
+        tts_mock.execute.side_effect = execute
+        speech = PlaybackService(bus=mock.Mock())
+        for utterance in ("0", "1", "2"):
+            speech.handle_speak(Message('speak', {'utterance': utterance}))
+        sleep(0.5)
+
+        played = [tts_cls_mock.queue.get_nowait()[1] for _ in range(3)]
+        self.assertEqual(played, ["0", "1", "2"])
+        tts_mock.execute.side_effect = None
+        speech.shutdown()
+
+    @mock.patch('mycroft.audio.service.TTS')
+    def test_speak_queue_failure(self, tts_cls_mock, tts_factory_mock,
+                                 config_mock):
+        """Ensure a failing queue doesn't block the following utterances."""
+        setup_mocks(config_mock, tts_factory_mock)
+        queue = Queue()
+        tts_cls_mock.queue = _TTSQueue(queue)
+
+        def execute(utterance, ident, listen):
+            tts_cls_mock.queue.put(("wav", utterance, None, ident, listen))
+
+        tts_mock.execute.side_effect = execute
+        speech = PlaybackService(bus=mock.Mock())
+        with mock.patch.object(queue, 'put', side_effect=[Exception, None]):
+            speech.handle_speak(Message('speak', {'utterance': 'one'}))
+            speech.handle_speak(Message('speak', {'utterance': 'two'}))
+            sleep(0.3)
+        self.assertEqual(speech._playback_cursor, 2)
+        tts_mock.execute.side_effect = None
+        speech.shutdown()
+
+    def test_speak_destination(self, tts_factory_mock, config_mock):
+        """Ensure speech targeted at other clients is not synthesized."""
+        setup_mocks(config_mock, tts_factory_mock)
+        speech = PlaybackService(bus=mock.Mock())
+        speech._synth = mock.Mock()
+        for dest in (["skills"], "skills"):
+            speech.handle_speak(Message('speak', {'utterance': 'hi'},
+                                        {'destination': dest}))
+        sleep(0.1)
+        self.assertFalse(speech._synth.called)
+
+        for dest in (["skills", "audio"], "debug_cli", None):
+            speech.handle_speak(Message('speak', {'utterance': 'hi'},
+                                        {'destination': dest}))
+        sleep(0.1)
+        self.assertEqual(speech._synth.call_count, 3)
+        speech.shutdown()
+
+    @mock.patch('mycroft.audio.service.TTS')
+    def test_queue_audio(self, tts_cls_mock, tts_factory_mock, config_mock):
+        """Ensure sounds are queued with their extension."""
+        setup_mocks(config_mock, tts_factory_mock)
+        tts_cls_mock.queue = _TTSQueue(Queue())
+        speech = PlaybackService(bus=mock.Mock())
+
+        speech.handle_queue_audio(Message('mycroft.audio.queue',
+                                          {'filename': __file__}))
+        audio_ext, audio_file, _, _, _ = tts_cls_mock.queue.get_nowait()
+        self.assertEqual(audio_ext, 'py')
+        self.assertEqual(audio_file, __file__)
+
+        speech.handle_queue_audio(Message('mycroft.audio.queue',
+                                          {'filename': __file__,
+                                           'audio_ext': 'wav',
+                                           'ident': 'test'}))
+        audio_ext, _, _, ident, _ = tts_cls_mock.queue.get_nowait()
+        self.assertEqual(audio_ext, 'wav')
+        self.assertEqual(ident, 'test')
+
+        with self.assertRaises(FileNotFoundError):
+            speech.handle_queue_audio(Message('mycroft.audio.queue',
+                                              {'filename': '/not/a/file.wav'}))
+        with self.assertRaises(FileNotFoundError):
+            speech.handle_queue_audio(Message('mycroft.audio.queue',
+                                              {'filename': dirname(__file__)}))
+        with self.assertRaises(ValueError):
+            speech.handle_queue_audio(Message('mycroft.audio.queue', {}))
+        speech.shutdown()
+
+    def test_reload_tts(self, tts_factory_mock, config_mock):
+        """Ensure TTS is reloaded when its settings change."""
+        setup_mocks(config_mock, tts_factory_mock)
+        speech = PlaybackService(bus=mock.Mock())
+        speech.config["tts"] = {"module": "mimic", "fallback_module": "mimic",
+                                "mimic": {"voice": "ap"}}
+        speech._maybe_reload_tts()
+        tts_factory_mock.create.reset_mock()
+
+        speech.config["lang"] = "pt-pt"
+        speech._maybe_reload_tts()
+        self.assertFalse(tts_factory_mock.create.called)
+
+        speech.config["tts"]["mimic"]["voice"] = "kal"
+        speech._maybe_reload_tts()
+        self.assertTrue(tts_factory_mock.create.called)
+        speech.shutdown()
+
+    def test_reload_tts_failure(self, tts_factory_mock, config_mock):
+        """Ensure a failed TTS reload is retried on the next change."""
+        setup_mocks(config_mock, tts_factory_mock)
+        speech = PlaybackService(bus=mock.Mock())
+        speech.config["tts"] = {"module": "mimic", "fallback_module": "mimic",
+                                "mimic": {"voice": "ap"}}
+        speech._maybe_reload_tts()
+
+        speech.config["tts"]["mimic"]["voice"] = "kal"
+        tts_factory_mock.create.side_effect = RuntimeError("broken voice")
+        with self.assertRaises(RuntimeError):
+            speech._maybe_reload_tts()
+
+        tts_factory_mock.create.reset_mock(side_effect=True)
+        tts_factory_mock.create.return_value = tts_mock
+        speech._maybe_reload_tts()
+        self.assertTrue(tts_factory_mock.create.called)
+        speech.shutdown()
+
+    @mock.patch('mycroft.audio.service.TTS')
+    def test_tts_cache(self, tts_cls_mock, tts_factory_mock, config_mock):
+        """Ensure repeated utterances are played without calling the engine."""
+        setup_mocks(config_mock, tts_factory_mock)
+        tts_cls_mock.queue = _TTSQueue(Queue())
+        tmp = mkdtemp()
+
+        def execute(utterance, ident, listen):
+            tts_cls_mock.queue.put(("wav", __file__, None, ident, listen,
+                                    "tts-id"))
+
+        tts_mock.execute.side_effect = execute
+        speech = PlaybackService(bus=mock.Mock())
+        speech._tts_cache = TTSAudioCache(tmp)
+        speech.execute_tts("hello", "first", False)
+        speech.execute_tts("hello", "second", True)
+
+        self.assertEqual(tts_mock.execute.call_count, 1)
+        self.assertEqual(tts_cls_mock.queue.get_nowait(),
+                         ("wav", __file__, None, "first", False, "tts-id"))
+        self.assertEqual(tts_cls_mock.queue.get_nowait(),
+                         ("wav", __file__, None, "second", True, "tts-id"))
+        tts_mock.execute.side_effect = None
+        speech.shutdown()
+        rmtree(tmp)
+
+    @mock.patch('mycroft.audio.service.TTS')
+    def test_tts_worker(self, tts_cls_mock, tts_factory_mock, config_mock):
+        """Ensure a worker returns the audio queued by its engine."""
+        setup_mocks(config_mock, tts_factory_mock)
+        tts_cls_mock.queue = None
+
+        def execute(utterance, ident, listen):
+            tts_cls_mock.queue.put(("wav", "/tmp/a.wav", None, ident, listen,
+                                    "tts-id"))
+
+        tts_mock.execute.side_effect = execute
+        _init_tts_worker({"tts": {"module": "mimic"}})
+        self.assertIsInstance(tts_cls_mock.queue, _TTSQueue)
+        tts_factory_mock.create.assert_called_with({"tts": {"module": "mimic"}})
+
+        queued = _tts_worker_execute("hello", "ident", True)
+        self.assertEqual(queued, [("wav", "/tmp/a.wav", None, "ident", True,
+                                   "tts-id")])
+        # nothing reached the worker's own queue
+        self.assertTrue(tts_cls_mock.queue.empty())
+        tts_mock.execute.side_effect = None
+
+    def test_tts_worker_broken(self, tts_factory_mock, config_mock):
+        """Ensure a broken worker pool is respawned on next use."""
+        setup_mocks(config_mock, tts_factory_mock)
+        config_mock.return_value["Audio"]["tts_workers"] = 1
+        speech = PlaybackService(bus=mock.Mock())
+        speech._tts_pool = mock.Mock()
+        speech._tts_pool.submit.side_effect = BrokenProcessPool()
+        with self.assertRaises(BrokenProcessPool):
+            speech._execute_engine("hello", "ident", False)
+        self.assertIsNone(speech._tts_pool)
+        speech.shutdown()
+
+    def test_tts_queue(self, tts_factory_mock, config_mock):
+        """Ensure the real TTS.queue is wrapped around an actual queue."""
+        setup_mocks(config_mock, tts_factory_mock)
+        # no TTS engine created yet, as in a fresh audio process
+        with mock.patch.object(TTS, 'queue', None):
+            speech = PlaybackService(bus=mock.Mock())
+            self.assertIsInstance(TTS.queue, _TTSQueue)
+            self.assertIsInstance(TTS.queue._queue, Queue)
+
+            speech.handle_queue_audio(Message('mycroft.audio.queue',
+                                              {'filename': __file__}))
+            self.assertFalse(TTS.queue.empty())
+            self.assertEqual(TTS.queue.get_nowait()[1], __file__)
+            speech.shutdown()
+
+    def test_split_sentences(self, tts_factory_mock, config_mock):
+        self.assertEqual(split_sentences("Hello there. How are you? Fine!"),
+                         ["Hello there.", "How are you?", "Fine!"])
+        self.assertEqual(split_sentences("one moment"), ["one moment"])
+        self.assertEqual(split_sentences("Dr. Smith will see you now."),
+                         ["Dr. Smith will see you now."])
+        ssml = '<speak>Hello there. <prosody rate="slow">How are you? ' \
+               'Fine.</prosody></speak>'
+        self.assertEqual(split_sentences(ssml), [ssml])
+
+    @mock.patch('mycroft.audio.service.TTS')
+    def test_speak_sentences(self, tts_cls_mock, tts_factory_mock,
+                             config_mock):
+        """Ensure each sentence is synthesized, listening after the last."""
+        setup_mocks(config_mock, tts_factory_mock)
+        tts_cls_mock.queue = _TTSQueue(Queue())
+        speech = PlaybackService(bus=mock.Mock())
+        speech.handle_speak(Message('speak', {'utterance': 'Hi. Bye.',
+                                              'expect_response': True}))
+        sleep(0.2)
+        tts_mock.execute.assert_has_calls([mock.call('Hi.', 'unknown', False),
+                                           mock.call('Bye.', 'unknown', True)],
+                                          any_order=True)
         speech.shutdown()
 
 
@@ -0,0 +1,88 @@
+"""Tests for the synthesized speech cache."""
+import os
+import unittest
+
+from os.path import exists, join
+from shutil import rmtree
+from tempfile import mkdtemp
+
+from mycroft.audio.tts_cache import TTSAudioCache, hash_utterance
+
+
+class TestTTSAudioCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp = mkdtemp()
+        self.cache_dir = join(self.tmp, "cache")
+        self.wav = join(self.tmp, "synth.wav")
+        with open(self.wav, "wb") as f:
+            f.write(b"\0" * 1024)
+
+    def tearDown(self):
+        rmtree(self.tmp)
+
+    def test_hash_utterance(self):
+        key = hash_utterance("mimic", "ap", "en-us", "hello")
+        self.assertEqual(len(key), 32)
+        self.assertEqual(key, hash_utterance("mimic", "ap", "en-us", "hello"))
+        self.assertNotEqual(key, hash_utterance("mimic", "kal", "en-us",
+                                                "hello"))
+
+    def test_put_get(self):
+        cache = TTSAudioCache(self.cache_dir)
+        self.assertIsNone(cache.get("key"))
+        cache.put("key", [("wav", self.wav, None, "tts-id")])
+        # the engine audio is referenced, not copied
+        self.assertEqual(cache.get("key"), [("wav", self.wav, None, "tts-id")])
+
+        # entries survive a restart
+        cache = TTSAudioCache(self.cache_dir)
+        self.assertEqual(cache.get("key")[0][1], self.wav)
+
+    def test_missing_audio(self):
+        cache = TTSAudioCache(self.cache_dir)
+        cache.put("key", [("wav", self.wav, None)])
+        os.remove(self.wav)
+        self.assertIsNone(cache.get("key"))
+
+    def test_ttl(self):
+        cache = TTSAudioCache(self.cache_dir, ttl=-1)
+        cache.put("key", [("wav", self.wav, None)])
+        self.assertIsNotNone(cache.get("key"))
+
+        cache.ttl = 1
+        cache.put("key", [("wav", self.wav, None)])
+        cache._entries["key"]["createAt"] = 0
+        self.assertIsNone(cache.get("key"))
+
+    def test_eviction(self):
+        cache = TTSAudioCache(self.cache_dir, max_entries=1,
+                              max_disk_entries=2)
+        for key in ("a", "b", "c"):
+            cache.put(key, [("wav", self.wav, None)])
+        self.assertIsNone(cache.get("a"))
+        self.assertIsNotNone(cache.get("b"))
+        self.assertIsNotNone(cache.get("c"))
+        self.assertTrue(exists(self.wav))
+
+    def test_eviction_reload(self):
+        cache = TTSAudioCache(self.cache_dir)
+        for key in ("a", "b"):
+            cache.put(key, [("wav", self.wav, None)])
+        os.utime(cache._meta_path("a"), (0, 0))
+        # entries left by a previous run count towards max_disk_entries
+        cache = TTSAudioCache(self.cache_dir, max_disk_entries=2)
+        cache.put("c", [("wav", self.wav, None)])
+        self.assertIsNone(cache.get("a"))
+        self.assertIsNotNone(cache.get("b"))
+        self.assertIsNotNone(cache.get("c"))
+
+    def test_clear(self):
+        cache = TTSAudioCache(self.cache_dir)
+        cache.put("key", [("wav", self.wav, None)])
+        cache.clear()
+        self.assertIsNone(cache.get("key"))
+        self.assertTrue(exists(self.cache_dir))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -12,10 +12,14 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 #
+from threading import Event
+from time import sleep
 from unittest import TestCase
 from unittest.mock import patch, Mock
 from mycroft.configuration import Configuration
-from mycroft.messagebus.client import MessageBusClient, MessageWaiter
+from mycroft.messagebus import Message
+from mycroft.messagebus.client import MessageBusClient, MessageWaiter, \
+    InProcessMessageBusClient
 
 WS_CONF = {
     'websocket': {
@@ -40,6 +44,56 @@ class TestMessageBusClient:
         assert mc.client.url == 'ws://testhost:1337/core'
 
 
+class TestInProcessMessageBusClient(TestCase):
+    @patch.dict(Configuration._Configuration__patch, WS_CONF)
+    def test_local_delivery(self):
+        sender = InProcessMessageBusClient()
+        receiver = InProcessMessageBusClient()
+        for bus in (sender, receiver):
+            bus.client = Mock()
+            bus.connected_event.set()
+
+        received = []
+        handled = Event()
+
+        def handler(message):
+            received.append(message)
+            handled.set()
+
+        receiver.on('test.message', handler)
+        sender.emit(Message('test.message', {'x': 1}))
+        self.assertTrue(handled.wait(1))
+        self.assertEqual(received[0].data, {'x': 1})
+        sender.client.send.assert_called_once()
+
+        # remote clients get the message as emitted
+        sent = Message.deserialize(sender.client.send.call_args[0][0])
+        self.assertEqual(sent.data, {'x': 1})
+        self.assertEqual(sent.context, {})
+
+        # the copy echoed back by the messagebus is dropped
+        handled.clear()
+        receiver.on_message(sender.client.send.call_args[0][0])
+        self.assertFalse(handled.wait(0.2))
+
+        # messages from remote clients are still handled
+        receiver.on_message(Message('test.message', {'x': 2}).serialize())
+        self.assertTrue(handled.wait(1))
+        self.assertEqual(received[-1].data, {'x': 2})
+
+        # identical messages are each matched with their own echo
+        for _ in range(2):
+            sender.emit(Message('test.message', {'x': 3}))
+        serialized = sender.client.send.call_args[0][0]
+        sleep(0.2)
+        handled.clear()
+        for _ in range(2):
+            receiver.on_message(serialized)
+        self.assertFalse(handled.wait(0.2))
+        receiver.on_message(serialized)
+        self.assertTrue(handled.wait(1))
+
+
 class TestMessageWaiter(TestCase):
     def test_message_wait_success(self):
         bus = Mock()